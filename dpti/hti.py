@@ -1,12 +1,13 @@
 #!/usr/bin/env python3
 
+import functools
 import glob
 import json
 import os
 import shutil
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 import numpy as np
-import pymbar
 import scipy.constants as pc
 
 # sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../'))
@@ -42,9 +43,9 @@ def _ff_lj_on(lamb, model, sparam):
     # sigma_oh = sparam['sigma_oh']
     # sigma_hh = sparam['sigma_hh']
     activation = sparam["activation"]
-    ret = ""
-    ret += "variable        EPSILON equal %f\n" % epsilon
-    ret += f"pair_style      lj/cut/soft {nn:f} {alpha_lj:f} {rcut:f}\n"
+    ret = []
+    ret.append("variable        EPSILON equal %f\n" % epsilon)
+    ret.append(f"pair_style      lj/cut/soft {nn:f} {alpha_lj:f} {rcut:f}\n")
 
     element_num = sparam.get("element_num", 1)
     sigma_key_index = filter(
@@ -52,20 +53,26 @@ def _ff_lj_on(lamb, model, sparam):
         ((i, j) for i in range(element_num) for j in range(element_num)),
     )
     for i, j in sigma_key_index:
-        ret += "pair_coeff      {} {} ${{EPSILON}} {:f} {:f}\n".format(
-            i + 1,
-            j + 1,
-            sparam["sigma_" + str(i) + "_" + str(j)],
-            activation,
+        ret.append(
+            "pair_coeff      {} {} ${{EPSILON}} {:f} {:f}\n".format(
+                i + 1,
+                j + 1,
+                sparam["sigma_" + str(i) + "_" + str(j)],
+                activation,
+            )
         )
 
     # ret += 'pair_coeff      * * ${EPSILON} %f %f\n' % (sigma, activation)
     # ret += 'pair_coeff      1 1 ${EPSILON} %f %f\n' % (sigma_oo, activation)
     # ret += 'pair_coeff      1 2 ${EPSILON} %f %f\n' % (sigma_oh, activation)
     # ret += 'pair_coeff      2 2 ${EPSILON} %f %f\n' % (sigma_hh, activation)
-    ret += "fix             tot_pot all adapt/fep 0 pair lj/cut/soft epsilon * * v_LAMBDA scale yes\n"
-    ret += "compute         e_diff all fep ${TEMP} pair lj/cut/soft epsilon * * v_EPSILON\n"
-    return ret
+    ret.append(
+        "fix             tot_pot all adapt/fep 0 pair lj/cut/soft epsilon * * v_LAMBDA scale yes\n"
+    )
+    ret.append(
+        "compute         e_diff all fep ${TEMP} pair lj/cut/soft epsilon * * v_EPSILON\n"
+    )
+    return "".join(ret)
 
 
 def _ff_deep_on(lamb, model, sparam, if_meam=False, meam_model=None):
@@ -78,29 +85,33 @@ def _ff_deep_on(lamb, model, sparam, if_meam=False, meam_model=None):
     # sigma_oh = sparam['sigma_oh']
     # sigma_hh = sparam['sigma_hh']
     activation = sparam["activation"]
-    ret = ""
-    ret += "variable        EPSILON equal %f\n" % epsilon
-    ret += "variable        ONE equal 1\n"
+    ret = []
+    ret.append("variable        EPSILON equal %f\n" % epsilon)
+    ret.append("variable        ONE equal 1\n")
     # if if_meam:
     #     ret += 'pair_style      hybrid/overlay meam lj/cut/soft %f %f %f  \n' % (nn, alpha_lj, rcut)
     #     ret += 'pair_coeff      * * meam /home/fengbo/4_Sn/meam_files/library_18Metal.meam Sn /home/fengbo/4_Sn/meam_files/Sn_18Metal.meam Sn \n'
     if if_meam:
-        ret += (
+        ret.append(
             "pair_style      hybrid/overlay meam lj/cut/soft {:f} {:f} {:f}\n".format(
                 nn,
                 alpha_lj,
                 rcut,
             )
         )
-        ret += f'pair_coeff      * * meam {meam_model["library"]} {meam_model["element"]} {meam_model["potential"]} {meam_model["element"]}\n'
+        ret.append(
+            f'pair_coeff      * * meam {meam_model["library"]} {meam_model["element"]} {meam_model["potential"]} {meam_model["element"]}\n'
+        )
     else:
-        ret += "pair_style      hybrid/overlay deepmd {} lj/cut/soft {:f} {:f} {:f}\n".format(
-            model,
-            nn,
-            alpha_lj,
-            rcut,
+        ret.append(
+            "pair_style      hybrid/overlay deepmd {} lj/cut/soft {:f} {:f} {:f}\n".format(
+                model,
+                nn,
+                alpha_lj,
+                rcut,
+            )
         )
-        ret += "pair_coeff      * * deepmd\n"
+        ret.append("pair_coeff      * * deepmd\n")
 
     element_num = sparam.get("element_num", 1)
     sigma_key_index = filter(
@@ -108,11 +119,13 @@ def _ff_deep_on(lamb, model, sparam, if_meam=False, meam_model=None):
         ((i, j) for i in range(element_num) for j in range(element_num)),
     )
     for i, j in sigma_key_index:
-        ret += "pair_coeff      {} {} lj/cut/soft ${{EPSILON}} {:f} {:f}\n".format(
-            i + 1,
-            j + 1,
-            sparam["sigma_" + str(i) + "_" + str(j)],
-            activation,
+        ret.append(
+            "pair_coeff      {} {} lj/cut/soft ${{EPSILON}} {:f} {:f}\n".format(
+                i + 1,
+                j + 1,
+                sparam["sigma_" + str(i) + "_" + str(j)],
+                activation,
+            )
         )
 
     # ret += 'pair_coeff      * * lj/cut/soft ${EPSILON} %f %f\n' % (sigma, activation)
@@ -120,14 +133,18 @@ def _ff_deep_on(lamb, model, sparam, if_meam=False, meam_model=None):
     # ret += 'pair_coeff      1 2 lj/cut/soft ${EPSILON} %f %f\n' % (sigma_oh, activation)
     # ret += 'pair_coeff      2 2 lj/cut/soft ${EPSILON} %f %f\n' % (sigma_hh, activation)
     if if_meam:
-        ret += "fix             tot_pot all adapt/fep 0 pair meam scale * * v_LAMBDA\n"
-        ret += "compute         e_diff all fep ${TEMP} pair meam scale * * v_ONE\n"
+        ret.append(
+            "fix             tot_pot all adapt/fep 0 pair meam scale * * v_LAMBDA\n"
+        )
+        ret.append("compute         e_diff all fep ${TEMP} pair meam scale * * v_ONE\n")
     else:
-        ret += (
+        ret.append(
             "fix             tot_pot all adapt/fep 0 pair deepmd scale * * v_LAMBDA\n"
         )
-        ret += "compute         e_diff all fep ${TEMP} pair deepmd scale * * v_ONE\n"
-    return ret
+        ret.append(
+            "compute         e_diff all fep ${TEMP} pair deepmd scale * * v_ONE\n"
+        )
+    return "".join(ret)
 
 
 # def _ff_meam_on(lamb,
@@ -176,30 +193,34 @@ def _ff_lj_off(lamb, model, sparam, if_meam=False, meam_model=None):
     # sigma_oh = sparam['sigma_oh']
     # sigma_hh = sparam['sigma_hh']
     activation = sparam["activation"]
-    ret = ""
-    ret += "variable        EPSILON equal %f\n" % epsilon
-    ret += "variable        INV_EPSILON equal -${EPSILON}\n"
+    ret = []
+    ret.append("variable        EPSILON equal %f\n" % epsilon)
+    ret.append("variable        INV_EPSILON equal -${EPSILON}\n")
     # if if_meam:
     #     ret += 'pair_style      hybrid/overlay meam lj/cut/soft %f %f %f  \n'  % (nn, alpha_lj, rcut)
     #     ret += 'pair_coeff      * * meam /home/fengbo/4_Sn/meam_files/library_18Metal.meam Sn /home/fengbo/4_Sn/meam_files/Sn_18Metal.meam Sn\n'
     if if_meam:
-        ret += (
+        ret.append(
             "pair_style      hybrid/overlay meam lj/cut/soft {:f} {:f} {:f}\n".format(
                 nn,
                 alpha_lj,
                 rcut,
             )
         )
-        ret += f'pair_coeff      * * meam {meam_model["library"]} {meam_model["element"]} {meam_model["potential"]} {meam_model["element"]}\n'
+        ret.append(
+            f'pair_coeff      * * meam {meam_model["library"]} {meam_model["element"]} {meam_model["potential"]} {meam_model["element"]}\n'
+        )
         # ret += f'pair_coeff      * * meam {meam_model[0]} {meam_model[2]} {meam_model[1]} {meam_model[2]}\n'
     else:
-        ret += "pair_style      hybrid/overlay deepmd {} lj/cut/soft {:f} {:f} {:f}\n".format(
-            model,
-            nn,
-            alpha_lj,
-            rcut,
+        ret.append(
+            "pair_style      hybrid/overlay deepmd {} lj/cut/soft {:f} {:f} {:f}\n".format(
+                model,
+                nn,
+                alpha_lj,
+                rcut,
+            )
         )
-        ret += "pair_coeff      * * deepmd\n"
+        ret.append("pair_coeff      * * deepmd\n")
 
     element_num = sparam.get("element_num", 1)
     sigma_key_index = filter(
@@ -207,20 +228,26 @@ def _ff_lj_off(lamb, model, sparam, if_meam=False, meam_model=None):
         ((i, j) for i in range(element_num) for j in range(element_num)),
     )
     for i, j in sigma_key_index:
-        ret += "pair_coeff      {} {} lj/cut/soft ${{EPSILON}} {:f} {:f}\n".format(
-            i + 1,
-            j + 1,
-            sparam["sigma_" + str(i) + "_" + str(j)],
-            activation,
+        ret.append(
+            "pair_coeff      {} {} lj/cut/soft ${{EPSILON}} {:f} {:f}\n".format(
+                i + 1,
+                j + 1,
+                sparam["sigma_" + str(i) + "_" + str(j)],
+                activation,
+            )
         )
 
     # ret += 'pair_coeff      * * lj/cut/soft ${EPSILON} %f %f\n' % (sigma, activation)
     # ret += 'pair_coeff      1 1 lj/cut/soft ${EPSILON} %f %f\n' % (sigma_oo, activation)
     # ret += 'pair_coeff      1 2 lj/cut/soft ${EPSILON} %f %f\n' % (sigma_oh, activation)
     # ret += 'pair_coeff      2 2 lj/cut/soft ${EPSILON} %f %f\n' % (sigma_hh, activation)
-    ret += "fix             tot_pot all adapt/fep 0 pair lj/cut/soft epsilon * * v_INV_LAMBDA scale yes\n"
-    ret += "compute         e_diff all fep ${TEMP} pair lj/cut/soft epsilon * * v_INV_EPSILON\n"
-    return ret
+    ret.append(
+        "fix             tot_pot all adapt/fep 0 pair lj/cut/soft epsilon * * v_INV_LAMBDA scale yes\n"
+    )
+    ret.append(
+        "compute         e_diff all fep ${TEMP} pair lj/cut/soft epsilon * * v_INV_EPSILON\n"
+    )
+    return "".join(ret)
 
 
 # def _ff_meam_lj_off(lamb,
@@ -255,56 +282,70 @@ def _ff_lj_off(lamb, model, sparam, if_meam=False, meam_model=None):
 #     return ret
 
 
-def _ff_spring(lamb, m_spring_k, var_spring):
-    ret = ""
+@functools.lru_cache(maxsize=16)
+def _ff_spring_fn(m_spring_k, var_spring):
+    """Spring block generator for a tuple of spring constants.
+
+    The groups and the energy sum do not depend on lambda; only the spring
+    constants do, and only when ``var_spring`` is set.
+    """
     ntypes = len(m_spring_k)
-    for ii in range(ntypes):
-        ret += f"group           type_{ii + 1} type {ii + 1}\n"
-    for ii in range(ntypes):
-        if var_spring:
-            m_spring_const = m_spring_k[ii] * (1 - lamb)
-        else:
-            m_spring_const = m_spring_k[ii]
-        ret += "fix             l_spring_{} type_{} spring/self {:.10e}\n".format(
-            ii + 1,
-            ii + 1,
-            m_spring_const,
-        )
-        ret += "fix_modify      l_spring_%s energy yes\n" % (ii + 1)
-    sum_str = "f_l_spring_1"
-    for ii in range(1, ntypes):
-        sum_str += "+f_l_spring_%s" % (ii + 1)
-    ret += "variable        l_spring equal %s\n" % (sum_str)
-    return ret
+    head = "".join(
+        f"group           type_{ii + 1} type {ii + 1}\n" for ii in range(ntypes)
+    )
+    fixes = "".join(
+        "fix             l_spring_%d type_%d spring/self {%d:.10e}\n"
+        "fix_modify      l_spring_%d energy yes\n" % (ii + 1, ii + 1, ii, ii + 1)
+        for ii in range(ntypes)
+    )
+    sum_str = "+".join("f_l_spring_%s" % (ii + 1) for ii in range(ntypes))
+    tail = "variable        l_spring equal %s\n" % (sum_str)
+    if not var_spring:
+        ret = head + fixes.format(*m_spring_k) + tail
+        return lambda lamb: ret
+    template = head + fixes + tail
+
+    def spring(lamb):
+        return template.format(*[kk * (1 - lamb) for kk in m_spring_k])
+
+    return spring
+
+
+def _ff_spring(lamb, m_spring_k, var_spring):
+    return _ff_spring_fn(tuple(m_spring_k), bool(var_spring))(lamb)
 
 
 def _ff_soft_lj(lamb, model, m_spring_k, step, sparam, if_meam=False, meam_model=None):
-    ret = ""
-    ret += "# --------------------- FORCE FIELDS ---------------------\n"
+    ret = []
+    ret.append("# --------------------- FORCE FIELDS ---------------------\n")
     if step == "lj_on":
-        ret += _ff_lj_on(lamb, model, sparam)
+        ret.append(_ff_lj_on(lamb, model, sparam))
         var_spring = False
     elif step == "deep_on":
         # ret += _ff_meam_on(lamb, model, sparam)
-        ret += _ff_deep_on(lamb, model, sparam, if_meam=if_meam, meam_model=meam_model)
+        ret.append(
+            _ff_deep_on(lamb, model, sparam, if_meam=if_meam, meam_model=meam_model)
+        )
         var_spring = False
     elif step == "spring_off":
         # ret += _ff_meam_lj_off(lamb, model, sparam)
-        ret += _ff_lj_off(lamb, model, sparam, if_meam=if_meam, meam_model=meam_model)
+        ret.append(
+            _ff_lj_off(lamb, model, sparam, if_meam=if_meam, meam_model=meam_model)
+        )
         var_spring = True
     else:
         raise RuntimeError("unkown step", step)
 
-    ret += _ff_spring(lamb, m_spring_k, var_spring)
+    ret.append(_ff_spring(lamb, m_spring_k, var_spring))
 
-    return ret
+    return "".join(ret)
 
 
 def _ff_two_steps(lamb, model, m_spring_k, step):
-    ret = ""
-    ret += "# --------------------- FORCE FIELDS ---------------------\n"
-    ret += "pair_style      deepmd %s\n" % model
-    ret += "pair_coeff * *\n"
+    ret = []
+    ret.append("# --------------------- FORCE FIELDS ---------------------\n")
+    ret.append("pair_style      deepmd %s\n" % model)
+    ret.append("pair_coeff * *\n")
 
     if step == "both" or step == "spring_off":
         var_spring = True
@@ -319,23 +360,105 @@ def _ff_two_steps(lamb, model, m_spring_k, step):
     else:
         raise RuntimeError("unkown step", step)
 
-    ret += _ff_spring(lamb, m_spring_k, var_spring)
+    ret.append(_ff_spring(lamb, m_spring_k, var_spring))
 
     if var_deep:
-        ret += "fix             l_deep all adapt 1 pair deepmd scale * * v_LAMBDA\n"
-    ret += "compute         e_deep all pe pair\n"
-    return ret
-
-
-def _gen_lammps_input(
+        ret.append(
+            "fix             l_deep all adapt 1 pair deepmd scale * * v_LAMBDA\n"
+        )
+    ret.append("compute         e_deep all pe pair\n")
+    return "".join(ret)
+
+
+_LMP_HEAD = """\
+clear
+# --------------------- VARIABLES-------------------------
+variable        NSTEPS          equal {nsteps:d}
+variable        THERMO_FREQ     equal {thermo_freq:d}
+variable        DUMP_FREQ       equal {dump_freq:d}
+variable        TEMP            equal {temp:f}
+variable        PRES            equal {pres:f}
+variable        TAU_T           equal {tau_t:f}
+variable        TAU_P           equal {tau_p:f}
+variable        LAMBDA          equal {lamb:.10e}
+variable        INV_LAMBDA      equal {inv_lamb:.10e}
+# ---------------------- INITIALIZAITION ------------------
+units           metal
+boundary        p p p
+atom_style      atomic
+# --------------------- ATOM DEFINITION ------------------
+box             tilt large
+read_data       {conf_file}
+{replicate}change_box      all triclinic
+{mass_block}{ff_block}\
+# --------------------- MD SETTINGS ----------------------
+neighbor        1.0 bin
+timestep        {timestep}
+thermo          ${{THERMO_FREQ}}
+compute         allmsd all msd
+thermo_style    custom step ke pe etotal enthalpy temp press vol {thermo_spring} {thermo_ener} c_allmsd[*]
+thermo_modify   format 9 %.16e
+thermo_modify   format 10 %.16e
+dump            1 all custom ${{DUMP_FREQ}} dump.hti id type x y z vx vy vz
+"""
+
+_LMP_ENS = {
+    "nvt": """\
+fix             1 all nvt temp ${{TEMP}} ${{TEMP}} ${{TAU_T}}
+""",
+    "nvt-langevin": """\
+fix             1 all nve
+fix             2 all langevin ${{TEMP}} ${{TEMP}} ${{TAU_T}} {langevin_seed:d} zero {langevin_zero}
+""",
+    "npt-iso": """\
+fix             1 all npt temp ${{TEMP}} ${{TEMP}} ${{TAU_T}} iso ${{PRES}} ${{PRES}} ${{TAU_P}}
+""",
+    "nve": """\
+fix             1 all nve
+""",
+}
+_LMP_ENS["npt"] = _LMP_ENS["npt-iso"]
+
+_LMP_INIT = """\
+# --------------------- INITIALIZE -----------------------
+velocity        all create ${{TEMP}} {velocity_seed:d}
+"""
+
+_LMP_CRYSTAL = {
+    "frenkel": """\
+fix             fc all recenter INIT INIT INIT
+fix             fm all momentum 1 linear 1 1 1
+velocity        all zero linear
+""",
+    "vega": """\
+group           first id 1
+fix             fc first recenter INIT INIT INIT
+fix             fm first momentum 1 linear 1 1 1
+velocity        first zero linear
+""",
+}
+
+_LMP_RUN = """\
+# --------------------- RUN ------------------------------
+run             ${{NSTEPS}}
+write_data      out.lmp
+"""
+
+# one template per (ens, crystal), the force field is filled in as a block
+_LMP_TEMPLATES = {
+    (ens, crystal): _LMP_HEAD + ens_str + _LMP_INIT + crystal_str + _LMP_RUN
+    for ens, ens_str in _LMP_ENS.items()
+    for crystal, crystal_str in _LMP_CRYSTAL.items()
+}
+
+
+def _gen_lammps_input_fn(
     conf_file,
     mass_map,
-    lamb,
     model,
     m_spring_k,
     nsteps,
     timestep,
-    ens,
     temp,
     pres=1.0,
     tau_t=0.1,
@@ -349,109 +472,129 @@ def _gen_lammps_input(
     step="both",
     if_meam=False,
     meam_model=None,
+    rng=None,
 ):
-    ret = ""
-    ret += "clear\n"
-    ret += "# --------------------- VARIABLES-------------------------\n"
-    ret += "variable        NSTEPS          equal %d\n" % nsteps
-    ret += "variable        THERMO_FREQ     equal %d\n" % thermo_freq
-    ret += "variable        DUMP_FREQ       equal %d\n" % dump_freq
-    ret += "variable        TEMP            equal %f\n" % temp
-    ret += "variable        PRES            equal %f\n" % pres
-    ret += "variable        TAU_T           equal %f\n" % tau_t
-    ret += "variable        TAU_P           equal %f\n" % tau_p
-    ret += "variable        LAMBDA          equal %.10e\n" % lamb
-    ret += "variable        INV_LAMBDA      equal %.10e\n" % (1 - lamb)
-    ret += "# ---------------------- INITIALIZAITION ------------------\n"
-    ret += "units           metal\n"
-    ret += "boundary        p p p\n"
-    ret += "atom_style      atomic\n"
-    ret += "# --------------------- ATOM DEFINITION ------------------\n"
-    ret += "box             tilt large\n"
-    ret += "read_data       %s\n" % conf_file
-    if copies is not None:
-        ret += "replicate       %d %d %d\n" % (copies[0], copies[1], copies[2])
-    ret += "change_box      all triclinic\n"
-    for jj in range(len(mass_map)):
-        ret += "mass            %d %f\n" % (jj + 1, mass_map[jj])
-
+    """Prepare the lambda-independent part of the HTI LAMMPS input.
+
+    Returns a function ``gen(lamb, ens)`` that only fills in the lambda
+    dependent settings, so that it can be called once per task. The
+    langevin and velocity seeds are drawn from ``rng``, a fresh
+    ``np.random.default_rng()`` if not given.
+    """
+    if rng is None:
+        rng = np.random.default_rng()
     # force field setting
     if switch == "one-step" or switch == "two-step":
-        ret += _ff_two_steps(lamb, model, m_spring_k, step)
+
+        def ff_block(lamb):
+            return _ff_two_steps(lamb, model, m_spring_k, step)
+
+        thermo_ener = "c_e_deep"
     elif switch == "three-step":
-        ret += _ff_soft_lj(
-            lamb,
-            model,
-            m_spring_k,
-            step,
-            sparam,
-            if_meam=if_meam,
-            meam_model=meam_model,
-        )
-    else:
-        raise RuntimeError("unknow switch", switch)
 
-    ret += "# --------------------- MD SETTINGS ----------------------\n"
-    ret += "neighbor        1.0 bin\n"
-    ret += "timestep        %s\n" % timestep
-    ret += "thermo          ${THERMO_FREQ}\n"
-    ret += "compute         allmsd all msd\n"
-    if 1 - lamb != 0:
-        if not isinstance(m_spring_k, list):
-            if switch == "three-step":
-                ret += "thermo_style    custom step ke pe etotal enthalpy temp press vol f_l_spring c_e_diff[1] c_allmsd[*]\n"
-            else:
-                ret += "thermo_style    custom step ke pe etotal enthalpy temp press vol f_l_spring c_e_deep c_allmsd[*]\n"
-        else:
-            if switch == "three-step":
-                ret += "thermo_style    custom step ke pe etotal enthalpy temp press vol v_l_spring c_e_diff[1] c_allmsd[*]\n"
-            else:
-                ret += "thermo_style    custom step ke pe etotal enthalpy temp press vol v_l_spring c_e_deep c_allmsd[*]\n"
-    else:
-        if switch == "three-step":
-            ret += "thermo_style    custom step ke pe etotal enthalpy temp press vol c_e_diff[1] c_e_diff[1] c_allmsd[*]\n"
-        else:
-            ret += "thermo_style    custom step ke pe etotal enthalpy temp press vol c_e_deep c_e_deep c_allmsd[*]\n"
-    ret += "thermo_modify   format 9 %.16e\n"
-    ret += "thermo_modify   format 10 %.16e\n"
-    ret += "dump            1 all custom ${DUMP_FREQ} dump.hti id type x y z vx vy vz\n"
-    if ens == "nvt":
-        ret += "fix             1 all nvt temp ${TEMP} ${TEMP} ${TAU_T}\n"
-    elif ens == "nvt-langevin":
-        ret += "fix             1 all nve\n"
-        ret += "fix             2 all langevin ${TEMP} ${TEMP} ${TAU_T} %d" % (
-            np.random.default_rng().integers(1, 2**16)
-        )
-        if crystal == "frenkel":
-            ret += " zero yes\n"
-        else:
-            ret += " zero no\n"
-    elif ens == "npt-iso" or ens == "npt":
-        ret += "fix             1 all npt temp ${TEMP} ${TEMP} ${TAU_T} iso ${PRES} ${PRES} ${TAU_P}\n"
-    elif ens == "nve":
-        ret += "fix             1 all nve\n"
-    else:
-        raise RuntimeError("unknow ensemble %s\n" % ens)
-    ret += "# --------------------- INITIALIZE -----------------------\n"
-    ret += "velocity        all create ${TEMP} %d\n" % (
-        np.random.default_rng().integers(1, 2**16)
-    )
-    if crystal == "frenkel":
-        ret += "fix             fc all recenter INIT INIT INIT\n"
-        ret += "fix             fm all momentum 1 linear 1 1 1\n"
-        ret += "velocity        all zero linear\n"
-    elif crystal == "vega":
-        ret += "group           first id 1\n"
-        ret += "fix             fc first recenter INIT INIT INIT\n"
-        ret += "fix             fm first momentum 1 linear 1 1 1\n"
-        ret += "velocity        first zero linear\n"
+        def ff_block(lamb):
+            return _ff_soft_lj(
+                lamb,
+                model,
+                m_spring_k,
+                step,
+                sparam,
+                if_meam=if_meam,
+                meam_model=meam_model,
+            )
+
+        thermo_ener = "c_e_diff[1]"
     else:
+        raise RuntimeError("unknow switch", switch)
+    if crystal not in _LMP_CRYSTAL:
         raise RuntimeError("unknow crystal " + crystal)
-    ret += "# --------------------- RUN ------------------------------\n"
-    ret += "run             ${NSTEPS}\n"
-    ret += "write_data      out.lmp\n"
+    if not isinstance(m_spring_k, list):
+        thermo_spring = "f_l_spring"
+    else:
+        thermo_spring = "v_l_spring"
+
+    base_params = {
+        "nsteps": int(nsteps),
+        "thermo_freq": int(thermo_freq),
+        "dump_freq": int(dump_freq),
+        "temp": temp,
+        "pres": pres,
+        "tau_t": tau_t,
+        "tau_p": tau_p,
+        "conf_file": conf_file,
+        "replicate": ""
+        if copies is None
+        else "replicate       %d %d %d\n" % (copies[0], copies[1], copies[2]),
+        "mass_block": "".join(
+            "mass            %d %f\n" % (jj + 1, mass_map[jj])
+            for jj in range(len(mass_map))
+        ),
+        "timestep": timestep,
+        "thermo_ener": thermo_ener,
+        "langevin_zero": "yes" if crystal == "frenkel" else "no",
+    }
+
+    def gen(lamb, ens):
+        if ens not in _LMP_ENS:
+            raise RuntimeError("unknow ensemble %s\n" % ens)
+        params = base_params.copy()
+        params["lamb"] = lamb
+        params["inv_lamb"] = 1 - lamb
+        params["ff_block"] = ff_block(lamb)
+        params["thermo_spring"] = thermo_spring if 1 - lamb != 0 else thermo_ener
+        if ens == "nvt-langevin":
+            params["langevin_seed"] = rng.integers(1, 2**16)
+        params["velocity_seed"] = rng.integers(1, 2**16)
+        return _LMP_TEMPLATES[(ens, crystal)].format_map(params)
+
+    return gen
 
-    return ret
+
+def _gen_lammps_input(
+    conf_file,
+    mass_map,
+    lamb,
+    model,
+    m_spring_k,
+    nsteps,
+    timestep,
+    ens,
+    temp,
+    pres=1.0,
+    tau_t=0.1,
+    tau_p=0.5,
+    thermo_freq=100,
+    dump_freq=100,
+    copies=None,
+    crystal="vega",
+    sparam={},
+    switch="one-step",
+    step="both",
+    if_meam=False,
+    meam_model=None,
+):
+    gen = _gen_lammps_input_fn(
+        conf_file,
+        mass_map,
+        model,
+        m_spring_k,
+        nsteps,
+        timestep,
+        temp,
+        pres=pres,
+        tau_t=tau_t,
+        tau_p=tau_p,
+        thermo_freq=thermo_freq,
+        dump_freq=dump_freq,
+        copies=copies,
+        crystal=crystal,
+        sparam=sparam,
+        switch=switch,
+        step=step,
+        if_meam=if_meam,
+        meam_model=meam_model,
+    )
+    return gen(lamb, ens)
 
 
 # def _gen_lammps_input_ideal (conf_file,
@@ -636,6 +779,21 @@ def make_tasks(iter_name, jdata, ref="einstein", switch="one-step", if_meam=None
         raise RuntimeError("unknow switch", switch)
 
 
+_SEED_STEPS = ("both", "lj_on", "deep_on", "spring_off")
+
+
+def _step_rng(seed, step):
+    """Generator of the task seeds of ``step``.
+
+    Each step draws from its own stream of ``seed``, so that the errors of
+    the steps, which are combined as independent, are not correlated. The
+    generator is not seeded if ``seed`` is None.
+    """
+    if seed is None:
+        return np.random.default_rng()
+    return np.random.default_rng([seed, _SEED_STEPS.index(step)])
+
+
 def _make_tasks(
     iter_name,
     jdata,
@@ -726,100 +884,117 @@ def _make_tasks(
     jdata["switch"] = switch
     jdata["step"] = step
 
-    create_path(iter_name)
-    copied_conf = os.path.join(os.path.abspath(iter_name), "conf.lmp")
+    iter_abs_path = create_path(iter_name)
+    copied_conf = os.path.join(iter_abs_path, "conf.lmp")
     if not link:
         shutil.copyfile(equi_conf, copied_conf)
     else:
-        cwd = os.getcwd()
-        os.chdir(iter_name)
-        os.symlink(os.path.relpath(equi_conf), "conf.lmp")
-        os.chdir(cwd)
+        os.symlink(os.path.relpath(equi_conf, start=iter_abs_path), copied_conf)
     jdata["equi_conf"] = "conf.lmp"
-    linked_model = os.path.join(os.path.abspath(iter_name), "graph.pb")
+    linked_model = os.path.join(iter_abs_path, "graph.pb")
     if not link:
         shutil.copyfile(model, linked_model)
     else:
-        cwd = os.getcwd()
-        os.chdir(iter_name)
-        os.symlink(os.path.relpath(model), "graph.pb")
-        os.chdir(cwd)
+        os.symlink(os.path.relpath(model, start=iter_abs_path), linked_model)
     jdata["model"] = "graph.pb"
     langevin = jdata.get("langevin", True)
 
-    cwd = os.getcwd()
-    os.chdir(iter_name)
-    with open("in.json", "w") as fp:
+    with open(os.path.join(iter_abs_path, "in.json"), "w") as fp:
         json.dump(jdata, fp, indent=4)
-    os.chdir(cwd)
-
-    for idx, ii in enumerate(all_lambda):
-        work_path = os.path.join(iter_name, "task.%06d" % idx)
-        create_path(work_path)
-        os.chdir(work_path)
-        os.symlink(os.path.relpath(copied_conf), "conf.lmp")
-        os.symlink(os.path.relpath(linked_model), "graph.pb")
+
+    ens = None
+    if jdata.get("ens", False):
+        ens = jdata.get("ens")
+    if ens is not None and ens != "nvt" and ens != "nvt-langevin":
+        raise RuntimeError(
+            f"Unknow ensemble '{ens}': one should use the NVT ensemble in the HTI step. The only supported values for the 'ens' keyword are 'nvt' and 'nvt-langevin'."
+        )
+    if ref == "einstein":
+        gen_lmp = _gen_lammps_input_fn(
+            "conf.lmp",
+            mass_map,
+            "graph.pb",
+            m_spring_k,
+            nsteps,
+            timestep,
+            temp,
+            thermo_freq=thermo_freq,
+            dump_freq=dump_freq,
+            copies=copies,
+            switch=switch,
+            step=step,
+            sparam=sparam,
+            crystal=crystal,
+            if_meam=if_meam,
+            meam_model=meam_model,
+            rng=_step_rng(jdata.get("seed", None), step),
+        )
+    elif ref == "ideal":
+        raise RuntimeError("choose hti_liq.py")
+        # lmp_str \
+        #     = _gen_lammps_input_ideal('conf.lmp',
+        #                               model_mass_map,
+        #                               ii,
+        #                               'graph.pb',
+        #                               nsteps,
+        #                               dt,
+        #                               ens,
+        #                               temp,
+        #                               prt_freq = stat_freq,
+        #                               copies = copies,
+        #                               if_meam = if_meam,
+        #                               meam_model = meam_model)
+    else:
+        raise RuntimeError("unknow reference system type " + ref)
+
+    # all the tasks sit side by side in iter_name, so the links are the same
+    rel_conf = os.path.join(os.pardir, os.path.basename(copied_conf))
+    rel_model = os.path.join(os.pardir, os.path.basename(linked_model))
+    # the one- and two-step inputs always load the deepmd model, only the
+    # three-step lj_on step and the three-step meam runs go without it
+    link_model = not (switch == "three-step" and (if_meam or step == "lj_on"))
+    if if_meam:
+        job_abs_path = os.path.dirname(iter_abs_path)
+        meam_library = os.path.join(
+            job_abs_path, os.path.basename(meam_model["library"])
+        )
+        meam_potential = os.path.join(
+            job_abs_path, os.path.basename(meam_model["potential"])
+        )
+
+    # iter_abs_path is freshly created, so none of the task dirs exist yet
+    task_dirs = [
+        os.path.join(iter_abs_path, "task.%06d" % idx) for idx in range(len(all_lambda))
+    ]
+    for work_path in task_dirs:
+        os.mkdir(work_path)
+
+    for idx, (ii, work_path) in enumerate(zip(all_lambda, task_dirs)):
+        os.symlink(rel_conf, os.path.join(work_path, "conf.lmp"))
+        if link_model:
+            os.symlink(rel_model, os.path.join(work_path, "graph.pb"))
         if if_meam:
-            meam_library_basename = os.path.basename(meam_model["library"])
-            meam_potential_basename = os.path.basename(meam_model["potential"])
-            relative_link_file(os.path.join("../../", meam_library_basename), "./")
-            relative_link_file(os.path.join("../../", meam_potential_basename), "./")
-        ens = None
-        if jdata.get("ens", False):
-            ens = jdata.get("ens")
-        if ens is not None and ens != "nvt" and ens != "nvt-langevin":
-            raise RuntimeError(
-                f"Unknow ensemble '{ens}': one should use the NVT ensemble in the HTI step. The only supported values for the 'ens' keyword are 'nvt' and 'nvt-langevin'."
-            )
-        if idx == 0:
+            relative_link_file(meam_library, work_path)
+            relative_link_file(meam_potential, work_path)
+        if idx == 0 or langevin:
             ens = "nvt-langevin"
         else:
             ens = "nvt"
-        if langevin:
-            ens = "nvt-langevin"
-        if ref == "einstein":
-            lmp_str = _gen_lammps_input(
-                "conf.lmp",
-                mass_map,
-                ii,
-                "graph.pb",
-                m_spring_k,
-                nsteps,
-                timestep,
-                ens,
-                temp,
-                thermo_freq=thermo_freq,
-                dump_freq=dump_freq,
-                copies=copies,
-                switch=switch,
-                step=step,
-                sparam=sparam,
-                crystal=crystal,
-                if_meam=if_meam,
-                meam_model=meam_model,
-            )
-        elif ref == "ideal":
-            raise RuntimeError("choose hti_liq.py")
-            # lmp_str \
-            #     = _gen_lammps_input_ideal('conf.lmp',
-            #                               model_mass_map,
-            #                               ii,
-            #                               'graph.pb',
-            #                               nsteps,
-            #                               dt,
-            #                               ens,
-            #                               temp,
-            #                               prt_freq = stat_freq,
-            #                               copies = copies,
-            #                               if_meam = if_meam,
-            #                               meam_model = meam_model)
-        else:
-            raise RuntimeError("unknow reference system type " + ref)
-        with open("in.lammps", "w") as fp:
+        lmp_str = gen_lmp(ii, ens)
+        with open(os.path.join(work_path, "in.lammps"), "w") as fp:
             fp.write(lmp_str)
-        with open("lambda.out", "w") as fp:
+        with open(os.path.join(work_path, "lambda.out"), "w") as fp:
             fp.write(str(ii))
-        os.chdir(cwd)
+
+
+def _list_tasks(iter_name):
+    """Sorted paths of the ``task.NNNNNN`` directories in ``iter_name``."""
+    with os.scandir(iter_name) as it:
+        return sorted(
+            ee.path
+            for ee in it
+            if ee.name.startswith("task.") and ee.name[5:].isdigit() and ee.is_dir()
+        )
 
 
 def refine_task(
@@ -844,36 +1019,41 @@ def refine_task(
         print(interval_nrefine)
         return
 
-    refined_t = []
-    back_map = []
-    for ii in range(0, ntask - 1):
-        refined_t.append(all_t[ii])
-        back_map.append(ii)
-        hh = (all_t[ii + 1] - all_t[ii]) / interval_nrefine[ii]
-        for jj in range(1, interval_nrefine[ii]):
-            refined_t.append(all_t[ii] + jj * hh)
-            back_map.append(-1)
-    refined_t.append(all_t[-1])
-    back_map.append(ntask - 1)
+    interval_nrefine = np.asarray(interval_nrefine)
+    # index of each refined point inside its original interval
+    offsets = np.cumsum(interval_nrefine) - interval_nrefine
+    sub_idx = np.arange(interval_nrefine.sum()) - np.repeat(offsets, interval_nrefine)
+    hh = (all_t[1:] - all_t[:-1]) / interval_nrefine
+    refined_t = np.repeat(all_t[:-1], interval_nrefine) + sub_idx * np.repeat(
+        hh, interval_nrefine
+    )
+    refined_t = np.append(refined_t, all_t[-1]).tolist()
+    back_map = np.full(len(refined_t), -1, dtype=int)
+    back_map[offsets] = np.arange(ntask - 1)
+    back_map[-1] = ntask - 1
+    back_map = back_map.tolist()
 
     from_json = os.path.join(from_task, "in.json")
     to_json = os.path.join(to_task, "in.json")
-    from_jdata = json.load(open(from_json))
+    with open(from_json) as fp:
+        from_jdata = json.load(fp)
     to_jdata = from_jdata
 
     to_jdata["lambda"] = refined_t
     to_jdata["orig_task"] = from_task
     to_jdata["back_map"] = back_map
     to_jdata["refine_error"] = err
+    if to_jdata.get("seed", None) is not None:
+        # the refined tasks must not repeat the seeds of the original ones
+        seed_seq = np.random.SeedSequence(to_jdata["seed"])
+        to_jdata["seed"] = int(seed_seq.generate_state(1)[0])
     to_jdata["equi_conf"] = get_task_file_abspath(from_task, from_jdata["equi_conf"])
     to_jdata["model"] = get_task_file_abspath(from_task, from_jdata["model"])
 
     make_tasks(to_task, to_jdata, to_jdata["reference"], if_meam=if_meam)
 
-    from_task_list = glob.glob(os.path.join(from_task, "task.[0-9]*"))
-    from_task_list.sort()
-    to_task_list = glob.glob(os.path.join(to_task, "task.[0-9]*"))
-    to_task_list.sort()
+    from_task_list = _list_tasks(from_task)
+    to_task_list = _list_tasks(to_task)
     assert len(from_task_list) == ntask
     assert len(to_task_list) == len(refined_t)
 
@@ -881,6 +1061,11 @@ def refine_task(
         if back_map[ii] < 0:
             continue
         for jj in ["data", "log.lammps"]:
+            # the ascii data is only written by post_tasks on request
+            if jj == "data" and not os.path.isfile(
+                os.path.join(from_task_list[back_map[ii]], jj)
+            ):
+                continue
             shutil.copyfile(
                 os.path.join(from_task_list[back_map[ii]], jj),
                 os.path.join(to_task_list[ii], jj),
@@ -889,8 +1074,100 @@ def refine_task(
             fp.write(from_task_list[back_map[ii]])
 
 
+def _read_task_lambda(task_dir):
+    with open(os.path.join(task_dir, "lambda.out")) as fp:
+        return float(fp.read())
+
+
+def _load_task_lambda(all_tasks):
+    """Lambda values recorded in ``lambda.out`` of the tasks."""
+    # the threads only pay off with a few files to read
+    if len(all_tasks) < 4:
+        return np.array([_read_task_lambda(ii) for ii in all_tasks], dtype=np.float64)
+    # the reads are I/O bound, overlap them for slow (network) file systems
+    with ThreadPoolExecutor(max_workers=min(16, len(all_tasks))) as ex:
+        return np.fromiter(
+            ex.map(_read_task_lambda, all_tasks),
+            dtype=np.float64,
+            count=len(all_tasks),
+        )
+
+
+def _save_data(fname, data):
+    """Write ``data`` as ``np.savetxt(fname, data, fmt="%.6e")`` does.
+
+    Each block of rows is formatted by a single ``%`` operation instead of
+    one per row, the blocks keep the text and the tuple of a long log small.
+    """
+    data = np.asarray(data)
+    if data.ndim == 1:
+        data = data[:, np.newaxis]
+    row_fmt = " ".join(["%.6e"] * data.shape[1]) + "\n"
+    with open(fname, "w") as fp:
+        for start in range(0, data.shape[0], 10000):
+            blk = data[start : start + 10000]
+            fp.write((row_fmt * blk.shape[0]) % tuple(blk.ravel().tolist()))
+
+
+def _load_task_thermo(task_dir, write_ascii=False):
+    """Thermo data of a task.
+
+    The parsed log is cached in ``data.npz`` together with the size and mtime
+    of ``log.lammps`` it was parsed from, and reused only while both still
+    match the log. The ascii ``data`` file is only written when
+    ``write_ascii`` is set.
+    """
+    log_name = os.path.join(task_dir, "log.lammps")
+    cache_name = os.path.join(task_dir, "data.npz")
+    log_stat = os.stat(log_name)
+    log_key = np.array([log_stat.st_size, log_stat.st_mtime_ns], dtype=np.int64)
+    data = None
+    if os.path.isfile(cache_name):
+        with np.load(cache_name) as cache:
+            if "log_key" in cache.files and np.array_equal(cache["log_key"], log_key):
+                data = cache["data"]
+    if data is None:
+        data = get_thermo(log_name)
+        np.savez(cache_name, data=data, log_key=log_key)
+    if write_ascii:
+        _save_data(os.path.join(task_dir, "data"), data)
+    return data
+
+
+def _parse_one_task(task_dir, stat_skip, stat_bsize, write_ascii=False):
+    """Block averages of spring, deep, etot and enthalpy, and the last msd."""
+    data = _load_task_thermo(task_dir, write_ascii=write_ascii)
+    avg, err = block_avg(data[:, [8, 9, 3, 4]], skip=stat_skip, block_size=stat_bsize)
+    return avg, err, data[-1, -1]
+
+
+def _load_task_energies(task_dir, stat_skip, write_ascii=False):
+    """Sampled deep and spring energies of a task, after ``stat_skip``."""
+    data = _load_task_thermo(task_dir, write_ascii=write_ascii)
+    return data[stat_skip:, 9], data[stat_skip:, 8]
+
+
+def _map_tasks(func, all_tasks):
+    """``map`` func over the task directories, in a process pool if worth it."""
+    # the pool only pays off with a few logs to parse
+    if len(all_tasks) < 4:
+        return list(map(func, all_tasks))
+    # no more workers than logs, a big node would fork a worker per core
+    max_workers = min(len(all_tasks), os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=max_workers) as ex:
+        return list(ex.map(func, all_tasks))
+
+
 def _compute_thermo(fname, natoms, stat_skip, stat_bsize):
     data = get_thermo(fname)
+    return _compute_thermo_from_data(data, natoms, stat_skip, stat_bsize)
+
+
+def _compute_thermo_from_data(data, natoms, stat_skip, stat_bsize):
+    """Thermo info of the parsed thermo ``data`` of a task, normalized by natoms.
+
+    Also used by ``hti_liq`` and ``hti_water`` on the data they parsed.
+    """
     ea, ee = block_avg(data[:, 3], skip=stat_skip, block_size=stat_bsize)
     ha, he = block_avg(data[:, 4], skip=stat_skip, block_size=stat_bsize)
     ta, te = block_avg(data[:, 5], skip=stat_skip, block_size=stat_bsize)
@@ -913,12 +1190,38 @@ def _compute_thermo(fname, natoms, stat_skip, stat_bsize):
     return thermo_info
 
 
+def _last_task_thermo(all_tasks, natoms, stat_skip, stat_bsize):
+    """Thermo info of the last task, once all the task logs were loaded.
+
+    The logs may have been parsed in worker processes, the data is then
+    read back from the fresh ``data.npz`` cache instead of the log.
+    """
+    data = _load_task_thermo(all_tasks[-1])
+    return _compute_thermo_from_data(data, natoms, stat_skip, stat_bsize)
+
+
+def _get_job_natoms(iter_name, jdata):
+    """Number of atoms in the (replicated) configuration of a job."""
+    equi_conf = get_task_file_abspath(iter_name, jdata["equi_conf"])
+    assert os.path.isfile(equi_conf)
+    natoms = get_natoms(equi_conf)
+    if "copies" in jdata:
+        natoms *= np.prod(jdata["copies"])
+    return natoms
+
+
 def post_tasks(iter_name, jdata, natoms=None, method="inte", scheme="s"):
-    switch = "one-step"
-    if os.path.isdir(os.path.join(iter_name, "00.deep_on")):
-        switch = "two-step"
-    if os.path.isdir(os.path.join(iter_name, "00.lj_on")):
+    with os.scandir(iter_name) as it:
+        subdirs = {ee.name for ee in it if ee.is_dir()}
+    if "00.lj_on" in subdirs:
         switch = "three-step"
+    elif "00.deep_on" in subdirs:
+        switch = "two-step"
+    else:
+        switch = "one-step"
+    if natoms is None:
+        # parse the configuration once for all the steps
+        natoms = _get_job_natoms(iter_name, jdata)
 
     if switch == "two-step":
         subtask_name = os.path.join(iter_name, "00.deep_on")
@@ -1031,71 +1334,55 @@ def _post_tasks(
 ):
     stat_skip = jdata["stat_skip"]
     stat_bsize = jdata["stat_bsize"]
-    all_tasks = glob.glob(os.path.join(iter_name, "task.[0-9]*"))
-    all_tasks.sort()
+    all_tasks = _list_tasks(iter_name)
     ntasks = len(all_tasks)
-    equi_conf = get_task_file_abspath(iter_name, jdata["equi_conf"])
-    assert os.path.isfile(equi_conf)
     if natoms is None:
-        natoms = get_natoms(equi_conf)
-        if "copies" in jdata:
-            natoms *= np.prod(jdata["copies"])
-
-    all_lambda = []
-    all_es = []
-    all_es_err = []
-    all_ed = []
-    all_ed_err = []
-
-    all_etot = []
-    all_etot_err = []
-    all_enthalpy = []
-    all_msd_xyz = []
-
-    for ii in all_tasks:
-        log_name = os.path.join(ii, "log.lammps")
-        data = get_thermo(log_name)
-        np.savetxt(os.path.join(ii, "data"), data, fmt="%.6e")
-        sa, se = block_avg(data[:, 8], skip=stat_skip, block_size=stat_bsize)
-        da, de = block_avg(data[:, 9], skip=stat_skip, block_size=stat_bsize)
-        etot, etot_err = block_avg(data[:, 3], skip=stat_skip, block_size=stat_bsize)
-        enthalpy, _ = block_avg(data[:, 4], skip=stat_skip, block_size=stat_bsize)
-        msd_xyz = data[-1, -1]
-        sa /= natoms
-        se /= np.sqrt(natoms)
-        da /= natoms
-        de /= np.sqrt(natoms)
-        lmda_name = os.path.join(ii, "lambda.out")
-        ll = float(open(lmda_name).read())
-        all_lambda.append(ll)
-        all_es.append(sa)
-        all_ed.append(da)
-        all_es_err.append(se)
-        all_ed_err.append(de)
-
-        all_etot.append(etot / natoms)
-        all_etot_err.append(etot_err)
-        all_enthalpy.append(enthalpy)
-        all_msd_xyz.append(msd_xyz)
-
-    all_lambda = np.array(all_lambda)
-    all_es = np.array(all_es)
-    all_ed = np.array(all_ed)
-    all_es_err = np.array(all_es_err)
-    all_ed_err = np.array(all_ed_err)
+        natoms = _get_job_natoms(iter_name, jdata)
+
+    write_ascii = jdata.get("write_ascii_data", False)
+
+    all_lambda = _load_task_lambda(all_tasks)
+    parse_one = functools.partial(
+        _parse_one_task,
+        stat_skip=stat_skip,
+        stat_bsize=stat_bsize,
+        write_ascii=write_ascii,
+    )
+    results = _map_tasks(parse_one, all_tasks)
+    avg = np.array([rr[0] for rr in results]).reshape(ntasks, 4)
+    err = np.array([rr[1] for rr in results]).reshape(ntasks, 4)
+
+    all_es = avg[:, 0] / natoms
+    all_ed = avg[:, 1] / natoms
+    all_es_err = err[:, 0] / np.sqrt(natoms)
+    all_ed_err = err[:, 1] / np.sqrt(natoms)
+
+    # the hti.out table, the scaled deep and spring terms shared by dU are
+    # written straight into their columns
+    all_print = np.empty((ntasks, 11))
+    all_print[:, 0] = all_lambda
+    inv_l = 1.0 / all_lambda
+    inv_1ml = 1.0 / (1 - all_lambda)
+    all_ud = np.multiply(all_ed, inv_l, out=all_print[:, 3])
+    all_us = np.multiply(all_es, inv_1ml, out=all_print[:, 4])
+    all_ud_err = np.multiply(all_ed_err, inv_l, out=all_print[:, 5])
+    all_us_err = np.multiply(all_es_err, inv_1ml, out=all_print[:, 6])
+    # etot (its error all_etot_err = err[:, 2] is not printed), spring energy,
+    # enthalpy and msd
+    np.divide(avg[:, 2], natoms, out=all_print[:, 7])
+    all_print[:, 8] = all_es
+    all_print[:, 9] = avg[:, 3]
+    all_print[:, 10] = [rr[2] for rr in results]
     if switch == "one-step" or switch == "two-step":
         if step == "both":
-            de = all_ed / all_lambda - all_es / (1 - all_lambda)
-            all_err = np.sqrt(
-                np.square(all_ed_err / all_lambda)
-                + np.square(all_es_err / (1 - all_lambda))
-            )
+            de = all_ud - all_us
+            all_err = np.hypot(all_ud_err, all_us_err)
         elif step == "deep_on":
-            de = all_ed / all_lambda
-            all_err = all_ed_err / all_lambda
+            de = all_ud
+            all_err = all_ud_err
         elif step == "spring_off":
-            de = -all_es / (1 - all_lambda)
-            all_err = all_es_err / (1 - all_lambda)
+            de = -all_us
+            all_err = all_us_err
         else:
             raise RuntimeError("unknow step", step)
     elif switch == "three-step":
@@ -1103,33 +1390,18 @@ def _post_tasks(
             de = all_ed
             all_err = all_ed_err
         elif step == "spring_off":
-            de = -all_es / (1 - all_lambda) + all_ed
-            all_err = np.sqrt(
-                np.square(all_es_err / (1 - all_lambda)) + np.square(all_ed_err)
-            )
+            de = -all_us + all_ed
+            all_err = np.hypot(all_us_err, all_ed_err)
         else:
             raise RuntimeError("unknow step", step)
     else:
         raise RuntimeError("unknow switch", switch)
 
-    all_print = []
-    # all_print.append(np.arange(len(all_lambda)))
-    all_print.append(all_lambda)
-    all_print.append(de)
-    all_print.append(all_err)
-    all_print.append(all_ed / all_lambda)
-    all_print.append(all_es / (1 - all_lambda))
-    all_print.append(all_ed_err / all_lambda)
-    all_print.append(all_es_err / (1 - all_lambda))
-    all_print.append(all_etot)
-    # all_print.append(all_etot_err)
-    all_print.append(all_es)
-    all_print.append(all_enthalpy)
-    all_print.append(all_msd_xyz)
-    all_print = np.array(all_print)
+    all_print[:, 1] = de
+    all_print[:, 2] = all_err
     np.savetxt(
         os.path.join(iter_name, "hti.out"),
-        all_print.T,
+        all_print,
         fmt="%.8e",
         header="lmbda dU dU_err Ud Us Ud_err Us_err etot spring_eng enthalpy msd_xyz",
     )
@@ -1160,94 +1432,108 @@ def _post_tasks(
         )
     else:
         print("# Not found end point, compute thermo info from the last lambda")
-        thermo_info = _compute_thermo(
-            os.path.join(all_tasks[-1], "log.lammps"), natoms, stat_skip, stat_bsize
-        )
+        thermo_info = _last_task_thermo(all_tasks, natoms, stat_skip, stat_bsize)
 
     return diff_e, [err, sys_err], thermo_info
 
 
+def _mbar_u_block(ed, rd, es, rs, ne=None):
+    """``ed * rd + es * rs``, in one threaded pass if the numexpr module ``ne``
+    is given.
+    """
+    if ne is not None:
+        return ne.evaluate("ed * rd + es * rs")
+    return ed * rd + es * rs
+
+
 def _post_tasks_mbar(iter_name, jdata, natoms=None, switch="one-step", step="both"):
+    # pymbar is only needed here, keep it out of the module import
+    import pymbar
+
+    # numexpr is optional, it only speeds up the two-term blocks
+    try:
+        import numexpr as ne
+    except ImportError:
+        ne = None
+
     stat_skip = jdata["stat_skip"]
     stat_bsize = jdata["stat_bsize"]
-    all_tasks = glob.glob(os.path.join(iter_name, "task.[0-9]*"))
-    all_tasks.sort()
+    all_tasks = _list_tasks(iter_name)
     ntasks = len(all_tasks)
-    equi_conf = jdata["equi_conf"]
-    cwd = os.getcwd()
-    os.chdir(iter_name)
-    assert os.path.isfile(equi_conf)
-    equi_conf = os.path.abspath(equi_conf)
-    os.chdir(cwd)
     temp = jdata["temp"]
     if natoms is None:
-        natoms = get_natoms(equi_conf)
-        if "copies" in jdata:
-            natoms *= np.prod(jdata["copies"])
+        natoms = _get_job_natoms(iter_name, jdata)
     print("# natoms: %d" % natoms)
 
-    all_lambda = []
-    for ii in all_tasks:
-        lmda_name = os.path.join(ii, "lambda.out")
-        ll = float(open(lmda_name).read())
-        all_lambda.append(ll)
-    all_lambda = np.array(all_lambda)
+    all_lambda = _load_task_lambda(all_tasks)
     nlambda = all_lambda.size
 
-    ukn = np.array([])
-    nk = []
     kt_in_ev = pc.Boltzmann * temp / pc.electron_volt
-    for idx, ii in enumerate(all_tasks):
-        log_name = os.path.join(ii, "log.lammps")
-        data = get_thermo(log_name)
-        np.savetxt(os.path.join(ii, "data"), data, fmt="%.6e")
-        this_ed = data[:, 9] / kt_in_ev
-        this_es = data[:, 8] / kt_in_ev
-        this_ed = this_ed[stat_skip::1]
-        this_es = this_es[stat_skip::1]
-        nk.append(this_ed.size)
-        if switch == "one-step" or switch == "two-step":
-            if step == "both":
-                ed = this_ed / all_lambda[idx]
-                es = this_es / (1 - all_lambda[idx])
-                block_u = []
-                for ll in all_lambda:
-                    block_u.append(ed * ll + es * (1 - ll))
-            elif step == "deep_on":
-                ed = this_ed / all_lambda[idx]
-                block_u = []
-                for ll in all_lambda:
-                    block_u.append(ed * ll)
-            elif step == "spring_off":
-                es = this_es / (1 - all_lambda[idx])
-                block_u = []
-                for ll in all_lambda:
-                    block_u.append(es * (1 - ll))
-            else:
-                raise RuntimeError("unknown switch_style", switch)
-        elif switch == "three-step":
-            if step == "lj_on" or step == "deep_on":
-                ed = this_ed
-                block_u = []
-                for ll in all_lambda:
-                    block_u.append(ed * ll)
-            elif step == "spring_off":
-                ed = this_ed
-                es = this_es / (1 - all_lambda[idx])
-                block_u = []
-                for ll in all_lambda:
-                    block_u.append(ed * ll + es * (1 - ll))
-            else:
-                raise RuntimeError("unknow step", step)
+    load_one = functools.partial(
+        _load_task_energies,
+        stat_skip=stat_skip,
+        write_ascii=jdata.get("write_ascii_data", False),
+    )
+    results = _map_tasks(load_one, all_tasks)
+    all_ed = [ed / kt_in_ev for ed, _ in results]
+    all_es = [es / kt_in_ev for _, es in results]
+    nk = np.array([this_ed.size for this_ed in all_ed])
+    # the samples of task idx fill the columns offs[idx]:offs[idx + 1]
+    offs = np.concatenate(([0], np.cumsum(nk)))
+
+    # reduced potential of every sample (columns) at every lambda (rows)
+    ukn = np.empty((nlambda, offs[-1]))
+    lamb = all_lambda[:, np.newaxis]
+    # scale factors taking the energies sampled at lambda_k (columns) to
+    # every lambda (rows)
+    ratio_d = lamb * (1.0 / all_lambda)
+    ratio_s = (1 - lamb) * (1.0 / (1 - all_lambda))
+    # pick the reduced potential of the step once, the task loop below is
+    # then a single broadcast per task
+    if switch == "one-step" or switch == "two-step":
+        if step == "both":
+
+            def kernel(ed, es, rd, rs):
+                return _mbar_u_block(ed, rd, es, rs, ne)
+
+        elif step == "deep_on":
+
+            def kernel(ed, es, rd, rs):
+                return ed * rd
+
+        elif step == "spring_off":
+
+            def kernel(ed, es, rd, rs):
+                return es * rs
+
         else:
-            raise RuntimeError("unknow switch", switch)
+            raise RuntimeError("unknow step", step)
+    elif switch == "three-step":
+        if step == "lj_on" or step == "deep_on":
+
+            def kernel(ed, es, rd, rs):
+                return ed * lamb
+
+        elif step == "spring_off":
+
+            def kernel(ed, es, rd, rs):
+                return _mbar_u_block(ed, lamb, es, rs, ne)
 
-        block_u = np.reshape(block_u, [nlambda, -1])
-        if ukn.size == 0:
-            ukn = block_u
         else:
-            ukn = np.concatenate((ukn, block_u), axis=1)
-    nk = np.array(nk)
+            raise RuntimeError("unknow step", step)
+    else:
+        raise RuntimeError("unknow switch", switch)
+
+    for idx in range(ntasks):
+        block_u = kernel(
+            all_ed[idx][np.newaxis, :],
+            all_es[idx][np.newaxis, :],
+            ratio_d[:, idx : idx + 1],
+            ratio_s[:, idx : idx + 1],
+        )
+        ukn[:, offs[idx] : offs[idx + 1]] = block_u
+    # pymbar solves on its own float64 copy of ukn, drop the samples first
+    del results, all_ed, all_es, block_u
 
     mbar = pymbar.MBAR(ukn, nk, initialize="BAR", relative_tolerance=1e-9)
     # Deltaf_ij, dDeltaf_ij, Theta_ij = mbar.getFreeEnergyDifferences()
@@ -1258,9 +1544,7 @@ def _post_tasks_mbar(iter_name, jdata, natoms=None, switch="one-step", step="bot
     diff_e = Deltaf_ij[0, -1] * kt_in_ev
     err = dDeltaf_ij[0, -1] * kt_in_ev
 
-    thermo_info = _compute_thermo(
-        os.path.join(all_tasks[-1], "log.lammps"), natoms, stat_skip, stat_bsize
-    )
+    thermo_info = _last_task_thermo(all_tasks, natoms, stat_skip, stat_bsize)
 
     return diff_e, [err, 0], thermo_info
 
@@ -1287,7 +1571,8 @@ def compute_task(
     # print('hti.compute_task', job, jdata, method, scheme, free_energy_type)
     # assert 'reference' in jdata
     # job = args.JOB
-    jdata = json.load(open(os.path.join(job, "in.json")))
+    with open(os.path.join(job, "in.json")) as fp:
+        jdata = json.load(fp)
     if "reference" not in jdata:
         jdata["reference"] = "einstein"
     if jdata["crystal"] == "vega":
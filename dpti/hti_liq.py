@@ -6,7 +6,6 @@ import os
 import shutil
 
 import numpy as np
-import scipy.constants as pc
 
 import dpti.lib.lmp as lmp
 
@@ -384,30 +383,6 @@ def make_tasks(iter_name, jdata, if_meam=None):
     _make_tasks(subtask_name, jdata, "soft_off", if_meam=if_meam, meam_model=meam_model)
 
 
-def _compute_thermo(fname, natoms, stat_skip, stat_bsize):
-    data = get_thermo(fname)
-    ea, ee = block_avg(data[:, 3], skip=stat_skip, block_size=stat_bsize)
-    ha, he = block_avg(data[:, 4], skip=stat_skip, block_size=stat_bsize)
-    ta, te = block_avg(data[:, 5], skip=stat_skip, block_size=stat_bsize)
-    pa, pe = block_avg(data[:, 6], skip=stat_skip, block_size=stat_bsize)
-    va, ve = block_avg(data[:, 7], skip=stat_skip, block_size=stat_bsize)
-    thermo_info = {}
-    thermo_info["p"] = pa
-    thermo_info["p_err"] = pe
-    thermo_info["v"] = va / natoms
-    thermo_info["v_err"] = ve / np.sqrt(natoms)
-    thermo_info["e"] = ea / natoms
-    thermo_info["e_err"] = ee / np.sqrt(natoms)
-    thermo_info["h"] = ha / natoms
-    thermo_info["h_err"] = he / np.sqrt(natoms)
-    thermo_info["t"] = ta
-    thermo_info["t_err"] = te
-    unit_cvt = 1e5 * (1e-10**3) / pc.electron_volt
-    thermo_info["pv"] = pa * va * unit_cvt / natoms
-    thermo_info["pv_err"] = pe * va * unit_cvt / np.sqrt(natoms)
-    return thermo_info
-
-
 def _post_tasks(iter_name, step, natoms):
     jdata = json.load(open(os.path.join(iter_name, "in.json")))
     stat_skip = jdata["stat_skip"]
@@ -460,9 +435,7 @@ def _post_tasks(iter_name, step, natoms):
     diff_e, err = integrate(all_lambda, de, all_err)
     sys_err = integrate_sys_err(all_lambda, de)
 
-    thermo_info = _compute_thermo(
-        os.path.join(all_tasks[-1], "log.lammps"), natoms, stat_skip, stat_bsize
-    )
+    thermo_info = hti._compute_thermo_from_data(data, natoms, stat_skip, stat_bsize)
 
     return diff_e, [err, sys_err], thermo_info
 
@@ -1,15 +1,18 @@
 #!/usr/bin/env python3
 
+import mmap
+import os
+
 import numpy as np
 
 
 def get_natoms(filename):
+    # the count is in the header, do not read the atom records
     with open(filename) as fp:
-        lines = fp.read().split("\n")
-    for ii in lines:
-        if "atoms" in ii:
-            natoms = int(ii.split()[0])
-            return natoms
+        for ii in fp:
+            if "atoms" in ii:
+                natoms = int(ii.split()[0])
+                return natoms
     raise RuntimeError("cannot find key word 'atoms' in " + filename)
 
 
@@ -26,24 +29,59 @@ def _is_n_number(inputs, nn):
     return True, res
 
 
-def get_thermo(filename):
+def _get_thermo_by_line(filename):
     with open(filename) as fp:
-        fc = fp.read().split("\n")
-    for sl in range(len(fc)):
-        if "Step " in fc[sl]:
-            break
-    nwords = len(fc[sl + 1].split())
-    data = []
-    for el in range(sl + 1, len(fc)):
-        flag, res = _is_n_number(fc[el], nwords)
-        if not flag:
-            break
-        else:
+        for line in fp:
+            if "Step " in line:
+                break
+        data = []
+        nwords = None
+        for line in fp:
+            if nwords is None:
+                nwords = len(line.split())
+            flag, res = _is_n_number(line, nwords)
+            if not flag:
+                break
             data.append(res)
     data = np.array(data)
     return data
 
 
+def get_thermo(filename):
+    # the thermo block normally runs from the header up to the "Loop time of"
+    # line; stream it from the file into numpy up to the first line that does
+    # not have the words of a thermo row, e.g. a warning or the end of an
+    # unfinished run, and only fall back to checking line by line when a row
+    # in the block does not parse
+    nrows = 0
+    data = None
+    with open(filename) as fp:
+        for line in fp:
+            if "Step " in line:
+                first = next(fp, "")
+                break
+        else:
+            first = ""
+        nwords = len(first.split())
+
+        def thermo_lines():
+            nonlocal nrows
+            line = first
+            while len(line.split()) == nwords and "Loop time of" not in line:
+                nrows += 1
+                yield line
+                line = next(fp, "")
+
+        if nwords > 0 and "Loop time of" not in first:
+            try:
+                data = np.loadtxt(thermo_lines(), ndmin=2, comments=None)
+            except ValueError:
+                data = None
+    if data is not None and data.shape == (nrows, nwords):
+        return data
+    return _get_thermo_by_line(filename)
+
+
 def get_thermo_old(filename):
     with open(filename) as fp:
         fc = fp.read().split("\n")
@@ -61,13 +99,16 @@ def get_thermo_old(filename):
 
 
 def get_last_dump(dump):
-    with open(dump) as fp:
-        lines = fp.read().split("\n")
-    lines = lines[:-1]
-    step_idx = -1
-    for idx, ii in enumerate(lines):
-        if "ITEM: TIMESTEP" in ii:
-            step_idx = idx
-    if step_idx == -1:
-        raise RuntimeError("cannot find timestep in lammps dump, something wrong")
-    return "\n".join(lines[step_idx:])
+    # the text of the last frame, without the final newline of the file
+    with open(dump, "rb") as fp:
+        if os.fstat(fp.fileno()).st_size == 0:
+            raise RuntimeError("cannot find timestep in lammps dump, something wrong")
+        with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            end = mm.rfind(b"\n")
+            step_idx = mm.rfind(b"ITEM: TIMESTEP", 0, max(end, 0))
+            if end == -1 or step_idx == -1:
+                raise RuntimeError(
+                    "cannot find timestep in lammps dump, something wrong"
+                )
+            start = mm.rfind(b"\n", 0, step_idx) + 1
+            return mm[start:end].decode()
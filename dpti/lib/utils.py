@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 
 import hashlib
+import math
 import os
 import pathlib
 import shutil
@@ -105,24 +106,24 @@ def copy_file_list(file_list, from_path, to_path):
 
 
 def block_avg(inp, skip=0, block_size=10):
-    inp = inp[skip:]
-    data_chunks = [
-        list(inp[i : i + block_size]) for i in range(0, len(inp), block_size)
-    ]
-    nblocks = len(data_chunks)
-    if len(data_chunks[-1]) != block_size:
-        nblocks -= 1
-        data_chunks = data_chunks[:nblocks]
-    assert len(data_chunks) == nblocks
+    """Block average of a time series.
+
+    ``inp`` may be 1-D, or 2-D with one column per quantity, in which case
+    all the columns are averaged at once and arrays are returned.
+    """
+    inp = np.asarray(inp)[skip:]
+    nblocks = len(inp) // block_size
     # naive avg
-    naive_avg = np.average(inp)
-    naive_err = np.std(inp) / np.sqrt(len(inp) - 1)
+    naive_avg = np.average(inp, axis=0)
+    naive_err = np.std(inp, axis=0) / np.sqrt(len(inp) - 1)
     # block avg
-    data_chunks = np.array(data_chunks)
+    data_chunks = inp[: nblocks * block_size].reshape(
+        (nblocks, block_size) + inp.shape[1:]
+    )
     data_block = np.average(data_chunks, axis=1)
-    block_avg = np.average(data_block)
+    block_avg = np.average(data_block, axis=0)
     if len(data_block) != 1:
-        block_err = np.std(data_block) / np.sqrt(nblocks - 1)
+        block_err = np.std(data_block, axis=0) / np.sqrt(nblocks - 1)
     else:
         block_err = naive_err
         warnings.warn(
@@ -206,7 +207,7 @@ def integrate_simpson(xx, yy, ye):
     if len(xx) % 2 == 0:
         diff_e, err = integrate_simpson(xx[:-1], yy[:-1], ye[:-1])
         diff_e1, err1 = integrate_trapezoidal(xx[-2:], yy[-2:], ye[-2:])
-        return diff_e + diff_e1, np.linalg.norm([err, err1])
+        return diff_e + diff_e1, math.hypot(err, err1)
     else:
         diff_e = 0
         err = 0
@@ -435,16 +436,14 @@ def compute_nrefine(all_t, integrand, err, error_scale=None):
     interval_err.append(
         interval_sys_err_trapezoidal(all_t[-3:], integrand[-3:], "right")
     )
+    interval_err = np.array(interval_err)
     if error_scale is not None:
-        for ii in range(0, ntask - 1):
-            interval_err[ii] *= error_scale[ii + 1]
-
-    interval_nrefine = []
-    for ii in range(ntask - 1):
-        err_dist = err * (all_t[ii + 1] - all_t[ii]) / (all_t[-1] - all_t[0])
-        interval_nrefine.append(
-            max(1, int(np.ceil(np.sqrt(interval_err[ii] / err_dist))))
-        )
+        interval_err *= np.asarray(error_scale)[1:ntask]
+
+    err_dist = err * np.diff(all_t) / (all_t[-1] - all_t[0])
+    interval_nrefine = np.maximum(
+        1, np.ceil(np.sqrt(interval_err / err_dist)).astype(int)
+    ).tolist()
     # print(interval_nrefine)
     assert len(interval_nrefine) == len(interval_err)
 
@@ -452,12 +451,9 @@ def compute_nrefine(all_t, integrand, err, error_scale=None):
 
 
 def get_task_file_abspath(task_name, file_name):
-    equi_conf = file_name
-    cwd = os.getcwd()
-    os.chdir(task_name)
-    equi_conf = os.path.abspath(equi_conf)
-    os.chdir(cwd)
-    return equi_conf
+    # resolve against the physical task directory, as a chdir into it would,
+    # without changing the working directory of the process
+    return os.path.abspath(os.path.join(os.path.realpath(task_name), file_name))
 
 
 def integrate_range_hti(all_lambda, de, de_err, scheme="s"):
@@ -469,7 +465,7 @@ def integrate_range_hti(all_lambda, de, de_err, scheme="s"):
                 all_lambda[-2:], de[-2:], de_err[-2:], scheme="t"
             )
             diff_e = i[-1] + i1[-1]
-            stt_err = np.linalg.norm([s_e[-1], s_e1[-1]])
+            stt_err = math.hypot(s_e[-1], s_e1[-1])
             sys_err = i_e[-1] + i_e1[-1]
         else:
             raise RuntimeError("lambda does not match!")
@@ -122,6 +122,85 @@ class TestHtiMakeTask(unittest.TestCase):
             f2 = os.path.join(test_dir, file)
             self.assertEqual(get_file_md5(f1), get_file_md5(f2), msg=(f1, f2))
 
+    def test_model_link(self):
+        # the tasks link graph.pb exactly when their in.lammps loads the model
+        cases = [
+            ("one_step", "one-step", {".": True}),
+            ("two_step", "two-step", {"00.deep_on": True, "01.spring_off": True}),
+            (
+                "three_step_meam",
+                "two-step",
+                {"00.deep_on": True, "01.spring_off": True},
+            ),
+            (
+                "three_step",
+                "three-step",
+                {"00.lj_on": False, "01.deep_on": True, "02.spring_off": True},
+            ),
+            (
+                "three_step_meam",
+                "three-step",
+                {"00.lj_on": False, "01.deep_on": False, "02.spring_off": False},
+            ),
+        ]
+        for test_name, switch, steps in cases:
+            json_file = os.path.join(self.benchmark_dir, test_name, "jdata.json")
+            with open(json_file) as f:
+                jdata = json.load(f)
+            test_dir = os.path.join(self.test_dir, "link_" + test_name + "_" + switch)
+            dpti.hti.make_tasks(iter_name=test_dir, jdata=jdata, switch=switch)
+            for step, linked in steps.items():
+                task_dir = os.path.join(test_dir, step, "task.000000")
+                with open(os.path.join(task_dir, "in.lammps")) as f:
+                    self.assertEqual("deepmd graph.pb" in f.read(), linked)
+                self.assertEqual(
+                    os.path.isfile(os.path.join(task_dir, "graph.pb")),
+                    linked,
+                    msg=(test_name, switch, step),
+                )
+
+    def test_seed(self):
+        benchmark_dir = os.path.join(self.benchmark_dir, "one_step")
+        json_file = os.path.join(benchmark_dir, "jdata.json")
+        in_lammps = []
+        for test_name in ["seed_0", "seed_1"]:
+            test_dir = os.path.join(self.test_dir, test_name)
+            with open(json_file) as f:
+                jdata = json.load(f)
+            jdata["seed"] = 1234
+            dpti.hti.make_tasks(iter_name=test_dir, jdata=jdata, switch="one-step")
+            in_lammps.append(
+                [
+                    get_file_md5(os.path.join(test_dir, "task.%06d" % ii, "in.lammps"))
+                    for ii in range(3)
+                ]
+            )
+        self.assertEqual(in_lammps[0], in_lammps[1])
+
+    def test_seed_steps(self):
+        # with a fixed seed, the steps and the tasks still get their own seeds
+        json_file = os.path.join(self.benchmark_dir, "three_step", "jdata.json")
+        with open(json_file) as f:
+            jdata = json.load(f)
+        jdata["seed"] = 1234
+        test_dir = os.path.join(self.test_dir, "seed_steps")
+        dpti.hti.make_tasks(iter_name=test_dir, jdata=jdata, switch="three-step")
+        all_seeds = {}
+        for step in ["00.lj_on", "01.deep_on", "02.spring_off"]:
+            for ii in range(4):
+                with open(
+                    os.path.join(test_dir, step, "task.%06d" % ii, "in.lammps")
+                ) as f:
+                    lines = f.read().split("\n")
+                all_seeds[step, ii] = tuple(
+                    ll.split()[-3] if "langevin" in ll else ll.split()[-1]
+                    for ll in lines
+                    if ll.startswith("fix             2 all langevin")
+                    or ll.startswith("velocity        all create")
+                )
+                self.assertEqual(len(all_seeds[step, ii]), 2)
+        self.assertEqual(len(set(all_seeds.values())), len(all_seeds))
+
     @classmethod
     def tearDownClass(cls):
         shutil.rmtree("tmp_hti/")
@@ -0,0 +1,264 @@
+import json
+import os
+import shutil
+import unittest
+
+import numpy as np
+from context import dpti
+
+from dpti.lib.utils import parse_seq
+
+try:
+    import pymbar
+
+    has_pymbar3 = hasattr(pymbar.MBAR, "getFreeEnergyDifferences")
+except ImportError:
+    has_pymbar3 = False
+
+try:
+    import numexpr
+except ImportError:
+    numexpr = None
+
+# lambda lists of the synthetic jobs, the even one of spring_off takes the
+# simpson + trapezoidal branch of the integration
+job_lambda = {
+    "lambda": ["0:1:0.25", "1"],
+    "lambda_deep_on": ["0:1:0.25", "1"],
+    "lambda_spring_off": ["0:1:0.2", "1"],
+    "lambda_lj_on": ["0:1:0.25", "1"],
+}
+job_steps = {
+    "one-step": {".": "lambda"},
+    "two-step": {"00.deep_on": "lambda_deep_on", "01.spring_off": "lambda_spring_off"},
+    "three-step": {
+        "00.lj_on": "lambda_lj_on",
+        "01.deep_on": "lambda_deep_on",
+        "02.spring_off": "lambda_spring_off",
+    },
+}
+job_jdata = {
+    "equi_conf": "conf.lmp",
+    "model": "graph.pb",
+    "reference": "einstein",
+    "crystal": "frenkel",
+    "mass_map": [118.71],
+    "spring_k": 0.02,
+    "nsteps": 600,
+    "timestep": 0.002,
+    "thermo_freq": 10,
+    "stat_skip": 10,
+    "stat_bsize": 10,
+    "temp": 400,
+    "protect_eps": 1e-6,
+}
+
+
+def _write_log(fname, lamb, shift, scale_deep=True, nrows=60):
+    """A LAMMPS log with a smooth, fixed thermo block of the hti columns.
+
+    The deep energy is scaled by lambda as in the one- and two-step inputs
+    unless ``scale_deep`` is unset.
+    """
+    xx = 0.37 * np.arange(nrows) + 1.3 * shift
+    kin = 7.4 + 0.5 * np.sin(xx)
+    pot = -1534.2 + 0.8 * np.cos(1.1 * xx)
+    msd = 0.01 * np.arange(nrows)[:, None] * np.array([1.0, 1.1, 0.9])
+    cols = [
+        10 * np.arange(nrows),
+        kin,
+        pot,
+        kin + pot,
+        kin + pot + 130 + 0.2 * np.sin(0.5 * xx),
+        400 + 20 * np.sin(0.9 * xx),
+        100 + 50 * np.cos(0.3 * xx),
+        3201.44 + 0.5 * np.sin(0.2 * xx),
+        (1 - lamb) * (7.5 + 0.3 * np.sin(1.7 * xx + lamb)),
+        (lamb if scale_deep else 1) * (-1534.2 + 0.3 * np.cos(0.9 * xx) + 0.5 * lamb),
+        msd[:, 0],
+        msd[:, 1],
+        msd[:, 2],
+        msd.sum(axis=1),
+    ]
+    with open(fname, "w") as fp:
+        fp.write("LAMMPS (synthetic)\n")
+        fp.write(
+            "Step KinEng PotEng TotEng Enthalpy Temp Press Volume v_l_spring"
+            " c_e_deep c_allmsd[1] c_allmsd[2] c_allmsd[3] c_allmsd[4]\n"
+        )
+        np.savetxt(fp, np.column_stack(cols), fmt="%.10e")
+        fp.write("Loop time of 1.0 on 1 procs for 600 steps with 144 atoms\n")
+
+
+def make_job(job_dir, switch):
+    """A finished hti job of ``switch`` made of synthetic logs."""
+    conf = os.path.join("lammps_test_files", "test_hti.lmp")
+    os.makedirs(job_dir)
+    shutil.copyfile(conf, os.path.join(job_dir, "conf.lmp"))
+    shutil.copyfile("graph.pb", os.path.join(job_dir, "graph.pb"))
+    jdata = dict(job_jdata, **job_lambda)
+    for step_idx, (step, lambda_key) in enumerate(job_steps[switch].items()):
+        step_dir = os.path.join(job_dir, step)
+        os.makedirs(step_dir, exist_ok=True)
+        shutil.copyfile(conf, os.path.join(step_dir, "conf.lmp"))
+        all_lambda = parse_seq(jdata[lambda_key])
+        all_lambda[0] += jdata["protect_eps"]
+        all_lambda[-1] -= jdata["protect_eps"]
+        for idx, lamb in enumerate(all_lambda):
+            task_dir = os.path.join(step_dir, "task.%06d" % idx)
+            os.mkdir(task_dir)
+            with open(os.path.join(task_dir, "lambda.out"), "w") as fp:
+                fp.write(str(lamb))
+            _write_log(
+                os.path.join(task_dir, "log.lammps"),
+                lamb,
+                idx + step_idx,
+                scale_deep=switch != "three-step",
+            )
+    with open(os.path.join(job_dir, "in.json"), "w") as fp:
+        json.dump(jdata, fp, indent=4)
+    return jdata
+
+
+class TestHtiLoadTaskThermo(unittest.TestCase):
+    def setUp(self):
+        self.maxDiff = None
+        self.test_dir = "tmp_hti_load_task_thermo"
+        self.log_file = os.path.join("lammps_test_files", "get_thermo.log.lammps")
+        os.mkdir(self.test_dir)
+        self.task_log = os.path.join(self.test_dir, "log.lammps")
+        shutil.copyfile(self.log_file, self.task_log)
+
+    def test_cached(self):
+        data1 = dpti.hti._load_task_thermo(self.test_dir)
+        self.assertTrue(os.path.isfile(os.path.join(self.test_dir, "data.npz")))
+        self.assertFalse(os.path.isfile(os.path.join(self.test_dir, "data")))
+        data2 = dpti.hti._load_task_thermo(self.test_dir, write_ascii=True)
+        np.testing.assert_array_equal(data1, data2)
+        # the ascii copy keeps 7 significant digits
+        np.testing.assert_allclose(
+            np.loadtxt(os.path.join(self.test_dir, "data")), data1, rtol=1e-6
+        )
+
+    def test_replaced_by_older_log(self):
+        data1 = dpti.hti._load_task_thermo(self.test_dir)
+        # another log copied in with an older mtime, as cp -p or rsync do
+        with open(self.log_file) as f:
+            lines = f.read().split("\n")
+        sl = next(ii for ii, ll in enumerate(lines) if "Step " in ll)
+        with open(self.task_log, "w") as f:
+            f.write("\n".join(lines[: sl + 11] + ["WARNING: stop"] + lines[sl + 11 :]))
+        old_ns = os.stat(self.task_log).st_mtime_ns - 3600 * 10**9
+        os.utime(self.task_log, ns=(old_ns, old_ns))
+        data2 = dpti.hti._load_task_thermo(self.test_dir)
+        self.assertEqual(data2.shape[0], 10)
+        np.testing.assert_array_equal(data2, data1[:10])
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+
+class TestHtiPostTasks(unittest.TestCase):
+    # the benchmark holds the results of the original implementation on the
+    # same synthetic jobs
+    @classmethod
+    def setUpClass(cls):
+        os.mkdir("tmp_hti_post/")
+        with open(os.path.join("benchmark_hti_post", "results.json")) as f:
+            cls.results = json.load(f)
+
+    def setUp(self):
+        self.maxDiff = None
+        self.test_dir = "tmp_hti_post"
+        self.benchmark_dir = "benchmark_hti_post"
+
+    def _check_post_tasks(self, switch, method):
+        test_name = switch.replace("-", "_")
+        job_dir = os.path.join(self.test_dir, test_name + "_" + method)
+        jdata = make_job(job_dir, switch)
+        de, err, thermo_info = dpti.hti.post_tasks(job_dir, jdata, method=method)
+        expected = self.results[test_name + "_" + method]
+        np.testing.assert_allclose(de, expected["de"], rtol=1e-9)
+        np.testing.assert_allclose(err, expected["err"], rtol=1e-6, atol=1e-12)
+        for key, value in expected["thermo"].items():
+            np.testing.assert_allclose(thermo_info[key], value, rtol=1e-9, err_msg=key)
+        if method == "inte":
+            for step in job_steps[switch]:
+                np.testing.assert_allclose(
+                    np.loadtxt(os.path.join(job_dir, step, "hti.out")),
+                    np.loadtxt(
+                        os.path.join(self.benchmark_dir, test_name, step, "hti.out")
+                    ),
+                    rtol=1e-8,
+                    err_msg=step,
+                )
+        return job_dir
+
+    def test_inte_one_step(self):
+        self._check_post_tasks("one-step", "inte")
+
+    def test_inte_two_step(self):
+        self._check_post_tasks("two-step", "inte")
+
+    def test_inte_three_step(self):
+        self._check_post_tasks("three-step", "inte")
+
+    @unittest.skipUnless(has_pymbar3, "needs the pymbar 3 MBAR interface")
+    def test_mbar_one_step(self):
+        self._check_post_tasks("one-step", "mbar")
+
+    @unittest.skipUnless(has_pymbar3, "needs the pymbar 3 MBAR interface")
+    def test_mbar_two_step(self):
+        self._check_post_tasks("two-step", "mbar")
+
+    @unittest.skipUnless(has_pymbar3, "needs the pymbar 3 MBAR interface")
+    def test_mbar_three_step(self):
+        self._check_post_tasks("three-step", "mbar")
+
+    @unittest.skipIf(numexpr is None, "numexpr is not installed")
+    def test_mbar_u_block(self):
+        rng = np.random.default_rng(0)
+        ed, es = rng.normal(size=(2, 1, 50))
+        rd, rs = rng.uniform(size=(2, 6, 1))
+        np.testing.assert_allclose(
+            dpti.hti._mbar_u_block(ed, rd, es, rs, numexpr),
+            dpti.hti._mbar_u_block(ed, rd, es, rs),
+            rtol=1e-14,
+        )
+
+    def test_refine_task(self):
+        job_dir = os.path.join(self.test_dir, "refine_from")
+        jdata = make_job(job_dir, "one-step")
+        dpti.hti.post_tasks(job_dir, jdata)
+        # the refined tasks draw their seeds from a new stream
+        jdata["seed"] = 1234
+        with open(os.path.join(job_dir, "in.json"), "w") as f:
+            json.dump(jdata, f)
+        to_dir = os.path.join(self.test_dir, "refine_to")
+        dpti.hti.refine_task(job_dir, to_dir, 1e-7)
+        with open(os.path.join(to_dir, "in.json")) as f:
+            to_jdata = json.load(f)
+        expected = self.results["refine"]
+        np.testing.assert_allclose(to_jdata["lambda"], expected["lambda"], rtol=1e-12)
+        self.assertEqual(to_jdata["back_map"], expected["back_map"])
+        self.assertNotEqual(to_jdata["seed"], 1234)
+        for idx, from_idx in enumerate(expected["back_map"]):
+            to_task = os.path.join(to_dir, "task.%06d" % idx)
+            if from_idx < 0:
+                self.assertFalse(os.path.isfile(os.path.join(to_task, "log.lammps")))
+                continue
+            from_task = os.path.join(job_dir, "task.%06d" % from_idx)
+            with open(os.path.join(to_task, "from.dir")) as f:
+                self.assertEqual(f.read(), os.path.abspath(from_task))
+            with open(os.path.join(to_task, "log.lammps")) as f1, open(
+                os.path.join(from_task, "log.lammps")
+            ) as f2:
+                self.assertEqual(f1.read(), f2.read())
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree("tmp_hti_post/")
+
+
+if __name__ == "__main__":
+    unittest.main()
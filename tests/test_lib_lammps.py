@@ -51,6 +51,23 @@ class TestGetThermo(unittest.TestCase):
         with self.assertRaises(AssertionError):
             assert_almost_equal(data1, data2, decimal=10)
 
+    def test_interrupted(self):
+        # a warning inside the thermo block ends it, as does a killed run
+        with open(self.log_file) as f:
+            lines = f.read().split("\n")
+        sl = next(ii for ii, ll in enumerate(lines) if "Step " in ll)
+        data2 = np.loadtxt(self.data_file)
+        # a line with the words of a row that does not parse is checked line
+        # by line
+        not_a_row = " ".join(["x"] * data2.shape[1])
+        for tail in ["WARNING: something wrong", "1000 1.0", not_a_row]:
+            log_file = self.log_file + ".interrupted"
+            with open(log_file, "w") as f:
+                f.write("\n".join([*lines[: sl + 11], tail, *lines[sl + 11 :]]))
+            data1 = get_thermo(log_file)
+            os.remove(log_file)
+            assert_almost_equal(data1, data2[:10], decimal=8)
+
 
 class TestGetLastDump(unittest.TestCase):
     def setUp(self):
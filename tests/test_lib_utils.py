@@ -5,7 +5,14 @@ import unittest
 import numpy as np
 from numpy.testing import assert_almost_equal
 
-from dpti.lib.utils import block_avg, integrate_range_hti, parse_seq, relative_link_file
+from dpti.lib.utils import (
+    block_avg,
+    compute_nrefine,
+    get_task_file_abspath,
+    integrate_range_hti,
+    parse_seq,
+    relative_link_file,
+)
 
 lambda_seq = [
     "0.00:0.05:0.010",
@@ -107,6 +114,15 @@ class TestBlockAvg(unittest.TestCase):
         self.assertAlmostEqual(avg1, avg2, places=8)
         self.assertAlmostEqual(err1, err2, places=8)
 
+    def test_multi_column(self):
+        data_file = "lammps_test_files/get_thermo.data"
+        data_array = np.loadtxt(data_file)
+        avg2, err2 = block_avg(data_array[:, [1, 3]], skip=2, block_size=5)
+        for idx, col in enumerate([1, 3]):
+            avg1, err1 = block_avg(data_array[:, col], skip=2, block_size=5)
+            self.assertAlmostEqual(avg1, avg2[idx], places=8)
+            self.assertAlmostEqual(err1, err2[idx], places=8)
+
 
 class TestIntegrateRangeHti(unittest.TestCase):
     def setUp(self):
@@ -144,6 +160,26 @@ class TestIntegrateRangeHti(unittest.TestCase):
         self.assertAlmostEqual(sys_err2, sys_err2, places=8)
 
 
+class TestComputeNrefine(unittest.TestCase):
+    def test_normal(self):
+        data = np.loadtxt("hti_test_files/odd.hti.out")
+        nrefine = compute_nrefine(data[:, 0], data[:, 1], 2e-7)
+        self.assertEqual(nrefine, [3, 3, 3, 2, 3, 3, 1, 1, 2, 2, 2, 2, 4, 4, 4, 1])
+        self.assertTrue(all(isinstance(ii, int) for ii in nrefine))
+
+
+class TestGetTaskFileAbspath(unittest.TestCase):
+    def test_normal(self):
+        cwd = os.getcwd()
+        equi_conf = get_task_file_abspath("hti_test_files", "../graph.pb")
+        self.assertEqual(equi_conf, os.path.join(os.path.realpath(cwd), "graph.pb"))
+        self.assertEqual(os.getcwd(), cwd)
+
+    def test_abs_path(self):
+        abs_path = os.path.abspath(__file__)
+        self.assertEqual(get_task_file_abspath("hti_test_files", abs_path), abs_path)
+
+
 class TestRelativeLinkFile(unittest.TestCase):
     @classmethod
     def setUpClass(cls):